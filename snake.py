@@ -3,9 +3,10 @@
 """
 
 import random
-from dataclasses import dataclass
-from enum import Enum
-from typing import List
+from collections import deque
+from collections.abc import Iterable
+from enum import Enum, IntEnum
+from typing import NamedTuple
 
 import pygame
 
@@ -13,6 +14,7 @@ __all__ = [
     "MoveResult",
     "Direction",
     "Coordinate",
+    "UniformGrid",
     "SnakeGame",
     "SnakeCanvas",
     "Canvas",
@@ -36,14 +38,15 @@ class MoveResult(Enum):
         """
         Indicate if this result indicates that the player lost
         """
-        return self in (MoveResult.COLISION, MoveResult.COLISION)
+        return self is MoveResult.COLISION or self is MoveResult.OVERFLOW
 
 
-class Direction(Enum):
-    LEFT = "left"
-    RIGHT = "right"
-    UP = "up"
-    DOWN = "down"
+class Direction(IntEnum):
+    # NOTE: Opposite directions only differ by their lowest bit
+    LEFT = 0
+    RIGHT = 1
+    UP = 2
+    DOWN = 3
 
     def get_opposite(self):
         """
@@ -55,7 +58,7 @@ class Direction(Enum):
         """
         Returns True if the directions are opposite to each others
         """
-        return self.get_opposite() == direction
+        return (self ^ direction) == 1
 
 
 # NOTE: Keep this global variables close to Direction enum
@@ -71,11 +74,20 @@ OPPOSITE_DIRECTIONS_MAP = {
     Direction.DOWN: Direction.UP,
 }
 
+# Offset (dx, dy) of each direction
+# NOTE: The x-axis goes right and the y-axis goes down
+_DIR_DELTA = {
+    Direction.LEFT: (-1, 0),
+    Direction.RIGHT: (1, 0),
+    Direction.UP: (0, -1),
+    Direction.DOWN: (0, 1),
+}
+
 
-@dataclass
-class Coordinate:
+class Coordinate(NamedTuple):
     """
     Represents a 2-d discret coordinate
+    NOTE: Being a tuple, hashing, comparison and unpacking are done in C
     """
 
     x: int
@@ -87,20 +99,6 @@ class Coordinate:
         """
         return (self.x, self.y)
 
-    def __iter__(self):
-        yield self.x
-        yield self.y
-
-    def __eq__(self, value: object) -> bool:
-        if value is None:
-            return False
-        if not isinstance(value, Coordinate):
-            raise NotImplementedError()
-        return self.totuple() == value.totuple()
-
-    def __hash__(self) -> int:
-        return hash(self.totuple())
-
     # NOTE: The x-axis goes right
     def left(self):
         """
@@ -145,10 +143,49 @@ class Coordinate:
         return False
 
 
+class UniformGrid:
+    """
+    Occupancy of a board split in unit cells.
+    Each cell counts the elements (snake's parts, obstacles, ...) it contains,
+    so a colision is resolved by looking at a single cell.
+    NOTE: The cells are packed as a single int `y * width + x`
+    """
+
+    def __init__(self, width, height):
+        self._counts = bytearray(width * height)
+
+    def add(self, cell):
+        """
+        Add an element on the cell
+        """
+        self._counts[cell] += 1
+
+    def remove(self, cell):
+        """
+        Remove an element from the cell
+        """
+        self._counts[cell] -= 1
+
+    def query(self, cell):
+        """
+        Returns the number of elements on the cell
+        """
+        return self._counts[cell]
+
+    def free_cells(self):
+        """
+        Returns all the cells that don't contain any element
+        """
+        return [cell for cell, count in enumerate(self._counts) if not count]
+
+
 class SnakeGame:
     """
     Represents all the computations for the snake's game.
     This does not handle the display.
+
+    NOTE: Internally, the cells are packed as a single int `y * width + x`.
+    They are only converted to `Coordinate` when exposed.
     """
 
     def __init__(self, width, height, start_len=3, overflows_allowed=True):
@@ -158,46 +195,99 @@ class SnakeGame:
         self._start_len = start_len
         self._overflows_allowed = overflows_allowed
         self._direction = Direction.RIGHT
-        self._snake = [  # NOTE: an ordered-set would have been better
-            Coordinate(i, 0) for i in range(start_len)
-        ]
-        self._all_coordinates = {
-            Coordinate(x, y) for x in range(self._width) for y in range(self._height)
-        }
+        # Offset applied to the head on each move, follows the direction
+        self._delta = _DIR_DELTA[self._direction]
+        # Same offset for a packed cell: moving by (dx, dy) adds dy * width + dx
+        self._step = self._enc(*self._delta)
+        # The head is on the right side, the tail on the left side
+        self._snake = deque(self._enc(i, 0) for i in range(start_len))
+        # Occupancy of the board, it is kept in sync in `move`
+        self._grid = UniformGrid(width, height)
+        for cell in self._snake:
+            self._grid.add(cell)
         self._apple = None
         self._new_apple()
+        # Cells changed by the last move, None if nothing changed
+        self._last_added = None
+        self._last_removed = None
 
     # Map operations
 
+    def _enc(self, x, y):
+        """
+        Pack the cell (x, y) into a single int
+        """
+        return y * self._width + x
+
+    def _dec(self, cell):
+        """
+        Unpack a cell into its (x, y) coordinate
+        """
+        y, x = divmod(cell, self._width)
+        return x, y
+
+    def _to_coordinate(self, cell):
+        """
+        Convert a cell to a Coordinate (None is kept as is)
+        """
+        if cell is None:
+            return None
+        return Coordinate(*self._dec(cell))
+
     def _get_free_coordinates(self):
         """
-        Returns all the coordinates that don't contain
+        Returns all the cells that don't contain
         a part of the snake's body
         """
-        return self._all_coordinates - set(self._snake)
+        return self._grid.free_cells()
 
     def _get_n_random_free_coordinates(self, n):
         """
         Find `n` random cells that does not contains
         a part of the snake
         """
-        free_coords = list(self._get_free_coordinates())
-        if n > free_coords:
+        total = self._width * self._height
+        if n > total - len(self._snake):
             return None
-        return random.sample(free_coords, n)
+        # Sample among all the cells and drop the ones occupied by the snake.
+        # This avoids listing all the free cells when the snake is small.
+        chosen = set()
+        for _ in range(10):
+            missing = n - len(chosen)
+            if not missing:
+                break
+            for cell in random.sample(range(total), missing):
+                if not self._grid.query(cell):
+                    chosen.add(cell)
+        else:
+            # Too many cells got rejected, pick the remaining ones
+            # among the free cells
+            free_coords = [c for c in self._get_free_coordinates() if c not in chosen]
+            chosen.update(random.sample(free_coords, n - len(chosen)))
+        return list(chosen)
 
     def _get_random_free_coordinate(self):
         """
         Find a random cell that does not contains
         a part of the snake
         """
-        free_coords = list(self._get_free_coordinates())
-        if not free_coords:
-            return None
         # NOTE: `random` library is cryptographically bad
         # So we get errors from static analyze tools
         # But this is fine for us here, so we can ignore them
-        return random.choice(free_coords)  # nosec # noqa: S311
+        total = self._width * self._height
+        if len(self._snake) * 2 > total:
+            # The board is mostly full: random draws would be rejected
+            # too often, enumerating the free cells is cheaper
+            free_coords = self._get_free_coordinates()
+            if not free_coords:
+                return None
+            return random.choice(free_coords)  # nosec # noqa: S311
+
+        # Rejection sampling: draw random cells until we find a free one
+        while True:
+            cell = random.randrange(total)  # nosec # noqa: S311
+            if not self._grid.query(cell):
+                return cell
 
     def _new_apple(self):
         """
@@ -211,14 +301,14 @@ class SnakeGame:
         """
         The coordinate of the snake's head
         """
-        return self._snake[-1]
+        return Coordinate(*self._dec(self._snake[-1]))
 
     @property
     def tail(self):
         """
         The coordinate of the snake's tail
         """
-        return self._snake[0]
+        return Coordinate(*self._dec(self._snake[0]))
 
     @property
     def width(self):
@@ -234,17 +324,35 @@ class SnakeGame:
         """
         return self._height
 
-    def get_snake(self):
+    def snake_snapshot(self):
         """
-        Returns the coordinates of the snake body
+        Returns a copy of the coordinates of the snake body
         """
-        return self._snake[:]
+        return [Coordinate(*self._dec(cell)) for cell in self._snake]
+
+    def iter_snake(self):
+        """
+        Iterate over the coordinates of the snake body without copying it
+        NOTE: The snake must not move during the iteration
+        """
+        return (Coordinate(*self._dec(cell)) for cell in self._snake)
 
     def get_apple(self):
         """
         Returns the coordinate of the apple
         """
-        return self._apple
+        return self._to_coordinate(self._apple)
+
+    def get_last_changes(self):
+        """
+        Returns the coordinates (added, removed) that changed
+        during the last move. Each of them can be None.
+        NOTE: This allows to only redraw what changed
+        """
+        return (
+            self._to_coordinate(self._last_added),
+            self._to_coordinate(self._last_removed),
+        )
 
     @property
     def score(self):
@@ -254,22 +362,6 @@ class SnakeGame:
         # Compute instead of keeping the count manually
         return len(self._snake) - self._start_len
 
-    def _next_coord(self):
-        """
-        Get the next coordinate of the snake's head
-        based on its current location and the snake's direction.
-        """
-        d = self._direction
-        if d == Direction.LEFT:
-            return self.head.left()
-        if d == Direction.RIGHT:
-            return self.head.right()
-        if d == Direction.UP:
-            return self.head.up()
-        if d == Direction.DOWN:
-            return self.head.down()
-        raise Exception(f"Invalid direction {d}")
-
     def set_direction(self, direction: Direction):
         """
         Set the active direction of the snake.
@@ -278,6 +370,8 @@ class SnakeGame:
         if self._direction.is_opposed(direction):
             return
         self._direction = direction
+        self._delta = _DIR_DELTA[direction]
+        self._step = self._enc(*self._delta)
 
     # This function does all the logic
     def move(self) -> MoveResult:
@@ -287,25 +381,50 @@ class SnakeGame:
 
         This returns the result of what happened
         """
-        coordinate = self._next_coord()
-        # If the game does not allow overflowing, then loose
-        if coordinate.is_outside(self._width, self._height):
+        self._last_added = None
+        self._last_removed = None
+        width, height = self._width, self._height
+        # Next position of the head, it may be outside of the map
+        head = self._snake[-1]
+        y, x = divmod(head, width)
+        dx, dy = self._delta
+        x += dx
+        y += dy
+        if 0 <= x < width and 0 <= y < height:
+            # Still on the map: the packed cell just moves by a fixed step
+            cell = head + self._step
+        else:
+            # If the game does not allow overflowing, then loose
             if not self._overflows_allowed:
                 return MoveResult.OVERFLOW
-            coordinate = coordinate.overflows(self._width, self._height)
+            # NOTE: The head is at most 1 cell outside of the map,
+            # shifting it back is cheaper than a modulo
+            if x < 0:
+                x += width
+            elif x >= width:
+                x -= width
+            if y < 0:
+                y += height
+            elif y >= height:
+                y -= height
+            cell = self._enc(x, y)
 
         # Check colisions
-        if coordinate != self.tail and coordinate in self._snake:
+        if cell != self._snake[0] and self._grid.query(cell):
             return MoveResult.COLISION
 
         # Check if it ate the apple
-        self._snake.append(coordinate)
-        if coordinate == self._apple:
+        self._snake.append(cell)
+        self._grid.add(cell)
+        self._last_added = cell
+        if cell == self._apple:
             # The snake grows => do not remove the tail
             self._new_apple()
         else:
             # Remove the tail to keep the same size
-            self._snake.pop(0)
+            tail = self._snake.popleft()
+            self._grid.remove(tail)
+            self._last_removed = tail
         return MoveResult.OK
 
 
@@ -316,6 +435,8 @@ class SnakeCanvas:
         self._position = position
         self._border = 1
         self._margin = 10
+        self._drawn_apple = None
+        self._build_rects()
 
     @property
     def x(self):
@@ -359,72 +480,114 @@ class SnakeCanvas:
         """
         return self._iheight + self._border * 2 + self._margin * 2
 
-    def _draw_coord(self, screen, coord: Coordinate, color):
+    def _build_rects(self):
         """
-        Utility function to draw an rectangle on the map.
-        NOTE: everything is just a rectangle for now,
-        we differentiate the elements based on their color.
+        Precompute the rectangle of each cell and of the border.
+        The geometry only changes with the position of the canvas.
         """
         u = self._unit
         xoffset = self.x + self._border + self._margin
         yoffset = self.y + self._border + self._margin
-        pygame.draw.rect(
-            screen,
-            color,
-            pygame.Rect(
-                (
-                    coord.x * u + xoffset,
-                    coord.y * u + yoffset,
-                ),
-                (u, u),
-            ),
+        self._cell_rects = [
+            [
+                pygame.Rect((x * u + xoffset, y * u + yoffset), (u, u))
+                for y in range(self._game.height)
+            ]
+            for x in range(self._game.width)
+        ]
+        self._border_rect = pygame.Rect(
+            (self.x + self._margin, self.y + self._margin),
+            (self._iwidth, self._iheight),
         )
 
+    def _draw_coord(self, screen, coord: Coordinate, color):
+        """
+        Utility function to draw an rectangle on the map.
+        NOTE: everything is just a rectangle for now,
+        we differentiate the elements based on their color.
+        A filled rectangle is drawn with `fill` which is faster than `draw.rect`
+        """
+        screen.fill(color, self._cell_rects[coord.x][coord.y])
+
     def _draw_border(self, screen):
         """
         Utility function to borders of the game.
         """
         thickness = 1
-        x = self.x + self._margin
-        y = self.y + self._margin
-        pygame.draw.rect(
-            screen,
-            "black",
-            pygame.Rect(
-                (x, y),
-                (self._iwidth, self._iheight),
-            ),
-            width=thickness,
-        )
+        pygame.draw.rect(screen, "black", self._border_rect, width=thickness)
 
     def _draw_apple(self, screen, apple: Coordinate):
         self._draw_coord(screen, apple, "red")
 
-    def _draw_snake(self, screen, snake: List[Coordinate]):
+    def _draw_snake(self, screen, snake: Iterable[Coordinate]):
         for coord in snake:
             self._draw_coord(screen, coord, "green")
 
     def set_position(self, position):
         self._position = position
+        self._build_rects()
+
+    def draw_background(self, screen):
+        """
+        Draw the static elements of the game
+        """
+        self._draw_border(screen)
 
     def draw(self, screen, border=True):
-        self._draw_apple(screen, self._game.get_apple())
-        self._draw_snake(screen, self._game.get_snake())
+        apple = self._game.get_apple()
+        if apple is not None:
+            self._draw_apple(screen, apple)
+        self._drawn_apple = apple
+        self._draw_snake(screen, self._game.iter_snake())
         if border:
             self._draw_border(screen)
 
+    def draw_incremental(self, screen, border=True):
+        """
+        Only redraw the cells that changed since the last frame,
+        the screen must still contain the previous frame.
+        Returns the rectangles that need to be updated on the display.
+        """
+        added, removed = self._game.get_last_changes()
+        dirty = []
+        # NOTE: The removed tail can be the new head, erase it first
+        if removed is not None:
+            self._draw_coord(screen, removed, "white")
+            dirty.append(self._cell_rects[removed.x][removed.y])
+        if added is not None:
+            self._draw_coord(screen, added, "green")
+            dirty.append(self._cell_rects[added.x][added.y])
+        apple = self._game.get_apple()
+        if apple != self._drawn_apple:
+            # The previous apple has been eaten, thus already covered by the head
+            if apple is not None:
+                self._draw_apple(screen, apple)
+                dirty.append(self._cell_rects[apple.x][apple.y])
+            self._drawn_apple = apple
+        if border and dirty:
+            # The cells on the edges overlap with the border
+            self._draw_border(screen)
+        return dirty
+
 
 class Canvas:
     def __init__(self, game: SnakeGame):
         snake = SnakeCanvas(game)
         self._snake_canvas = snake
+        # NOTE: Keep the native format of the display.
+        # SDL2 ignores an 8-bit depth for the window, and drawing on an 8-bit
+        # palette surface requires a conversion on each blit to the display.
         self._screen = pygame.display.set_mode((snake.width, snake.height))
+        # The empty board never changes: render it once and copy it on `clear`
+        self._background = pygame.Surface(self._screen.get_size()).convert()
+        self._background.fill("white")
+        snake.draw_background(self._background)
 
     def clear(self):
         """
         Remove everything from the current display.
         """
-        self._screen.fill("white")
+        self._screen.blit(self._background, (0, 0))
 
     def draw_game(self):
         """
@@ -432,19 +595,30 @@ class Canvas:
         """
         self._snake_canvas.draw(self._screen)
 
-    def display(self):
+    def draw_incremental(self):
+        """
+        Render only the elements of the game that changed since the last frame.
+        Returns the rectangles to pass to `display`.
+        """
+        return self._snake_canvas.draw_incremental(self._screen)
+
+    def display(self, rects=None):
         """
         Show the new frame.
+        If `rects` is given, only these areas of the display are updated.
         NOTE: This works using the double-buffering strategy
         See "Software double buffering" in https://en.wikipedia.org/wiki/Multiple_buffering
         """
-        pygame.display.flip()
+        if rects is None:
+            pygame.display.flip()
+        else:
+            pygame.display.update(rects)
 
 
 class FPSFrames:
     """
     Utility class to manage the game loop.
-    - It yields every frames
+    - It yields every frames with the time elapsed since the previous one
     - We can stop it smoothly
     """
 
@@ -461,18 +635,21 @@ class FPSFrames:
 
     def __iter__(self):
         """
-        Yield the current frame on each loop
+        Yield the current frame and the elapsed time (in seconds)
+        since the previous frame on each loop
         """
         clock = pygame.time.Clock()
         i = self._start_index
         fps = self._fps
+        dt = 0.0
         while self._running:
-            yield i
+            yield i, dt
             i += 1
-            clock.tick(fps)  # limits FPS to 60
+            dt = clock.tick(fps) / 1000  # limits FPS to 60
 
 
 WIDTH, HEIGHT = 15, 15
+MOVES_PER_SECOND = 15
 
 
 # Base exemple taken from the documentation:
@@ -491,36 +668,64 @@ def run_game(width=WIDTH, height=HEIGHT):
     game = SnakeGame(width, height)
     canvas = Canvas(game)
     frames = FPSFrames()
-    for f in frames:
+    # The snake moves at a fixed rate, independently of the FPS
+    step = 1 / MOVES_PER_SECOND
+    elapsed = 0.0
+    # The first frame must be fully drawn
+    redraw = True
+
+    # Bind the constants locally, they are used on each frame
+    quit_event, keydown_event = pygame.QUIT, pygame.KEYDOWN
+    expose_event = pygame.VIDEOEXPOSE
+    key_directions = {
+        pygame.K_LEFT: Direction.LEFT,
+        pygame.K_RIGHT: Direction.RIGHT,
+        pygame.K_UP: Direction.UP,
+        pygame.K_DOWN: Direction.DOWN,
+    }
+    get_events = pygame.event.get
+    # Only queue the events we handle (e.g. drop the mouse motions)
+    # NOTE: Filtering in `pygame.event.get` would leave the other
+    # events in the queue until it is full
+    pygame.event.set_blocked(None)
+    pygame.event.set_allowed([quit_event, keydown_event, expose_event])
+    for _, dt in frames:
         # poll for events
         # pygame.QUIT event means the user clicked X to close your window
         # https://www.pygame.org/docs/ref/event.html
-        for event in pygame.event.get():
-            if event.type == pygame.QUIT:
+        for event in get_events():
+            if event.type == quit_event:
                 frames.stop()
-            if event.type == pygame.KEYDOWN:
-                key = event.key
-                if key == pygame.K_LEFT:
-                    game.set_direction(Direction.LEFT)
-                elif key == pygame.K_RIGHT:
-                    game.set_direction(Direction.RIGHT)
-                elif key == pygame.K_UP:
-                    game.set_direction(Direction.UP)
-                elif key == pygame.K_DOWN:
-                    game.set_direction(Direction.DOWN)
-
-        # Don't move each frame, this would be too fast
-        # NOTE: This is a drity trick, we should instead use the elapsed time
-        if f % 4 == 0:
+            elif event.type == expose_event:
+                # The window's content may have been lost
+                redraw = True
+            elif event.type == keydown_event:
+                direction = key_directions.get(event.key)
+                if direction is not None:
+                    game.set_direction(direction)
+
+        # Move once for each step of time elapsed.
+        # NOTE: Don't try to catch up after a long freeze of the window
+        elapsed = min(elapsed + dt, step * 3)
+        dirty = []
+        while elapsed >= step:
+            elapsed -= step
             res = game.move()
             if res.is_lost:
                 print(f"Final Score: {game.score}")
                 frames.stop()
-
-        # fill the screen with a color to wipe away anything from last frame
-        canvas.clear()
-        canvas.draw_game()
-        canvas.display()
+                break
+            # Only a few cells changed, don't redraw the whole screen
+            dirty += canvas.draw_incremental()
+
+        if redraw:
+            # fill the screen with a color to wipe away anything from last frame
+            canvas.clear()
+            canvas.draw_game()
+            canvas.display()
+            redraw = False
+        elif dirty:
+            canvas.display(dirty)
 
         # For snake, we could use the FPS to handle the speed to simplify
         # clock.tick(10)  # limits FPS to 60